@@ -15,6 +15,20 @@ import hashlib
 import ipaddress
 from six import string_types
 
+_sha1 = hashlib.sha1
+
+
+def vip_hash(vip):
+    """Return the short hash used to name a VIP resource bound to no nic.
+
+    The hash forms part of the Pacemaker resource name, so it has to stay
+    SHA-1 based to match the resources created by earlier releases.
+
+    :param vip: string - Virtual IP
+    :returns: string - First 7 characters of the SHA-1 hex digest of vip
+    """
+    return _sha1(vip.encode('UTF-8')).hexdigest()[:7]
+
 
 class CRM(dict):
     """
@@ -563,6 +577,10 @@ class ResourceDescriptor(object):
     how to configure pacemaker.
     """
 
+    # The kind of resource described, resources of the same kind are
+    # grouped together
+    kind = None
+
     def configure_resource(self, crm):
         """Configures the logical resource(s) within the CRM.
 
@@ -577,6 +595,8 @@ class ResourceDescriptor(object):
 
 
 class InitService(ResourceDescriptor):
+    kind = 'init'
+
     def __init__(self, service_name, init_service_name, clone=True):
         """Class for managing init resource
 
@@ -609,6 +629,8 @@ class InitService(ResourceDescriptor):
 
 
 class VirtualIP(ResourceDescriptor):
+    kind = 'vip'
+
     def __init__(self, service_name, vip, nic=None, cidr=None):
         """Class for managing VIP resource
 
@@ -623,18 +645,27 @@ class VirtualIP(ResourceDescriptor):
         self.nic = nic
         self.cidr = cidr
 
+    @property
+    def res_key(self):
+        """Name of the Pacemaker resource managing the vip
+
+        :returns: string
+        """
+        if not isinstance(ipaddress.ip_address(self.vip),
+                          ipaddress.IPv4Address):
+            return 'res_{}_{}_{}_vip'.format(self.service_name, self.nic,
+                                             'ipv6addr')
+        if self.nic:
+            return 'res_{}_{}_vip'.format(self.service_name, self.nic)
+        return 'res_{}_{}_vip'.format(self.service_name, vip_hash(self.vip))
+
     def configure_resource(self, crm):
         """Configure new vip resource in crm
 
         :param crm: CRM() instance - Config object for Pacemaker resources
         :returns: None
         """
-        if self.nic:
-            vip_key = 'res_{}_{}_vip'.format(self.service_name, self.nic)
-        else:
-            vip_key = 'res_{}_{}_vip'.format(
-                self.service_name,
-                hashlib.sha1(self.vip.encode('UTF-8')).hexdigest()[:7])
+        vip_key = self.res_key
         ipaddr = ipaddress.ip_address(self.vip)
         if isinstance(ipaddr, ipaddress.IPv4Address):
             res_type = 'ocf:heartbeat:IPaddr2'
@@ -642,9 +673,6 @@ class VirtualIP(ResourceDescriptor):
         else:
             res_type = 'ocf:heartbeat:IPv6addr'
             res_params = 'ipv6addr="{}"'.format(self.vip)
-            vip_params = 'ipv6addr'
-            vip_key = 'res_{}_{}_{}_vip'.format(self.service_name, self.nic,
-                                                vip_params)
 
         if self.nic:
             res_params = '{} nic="{}"'.format(res_params, self.nic)
@@ -659,6 +687,8 @@ class VirtualIP(ResourceDescriptor):
 
 class DNSEntry(ResourceDescriptor):
 
+    kind = 'hostname'
+
     def __init__(self, service_name, ip, fqdn, endpoint_type):
         """Class for managing DNS entries
 
@@ -674,6 +704,16 @@ class DNSEntry(ResourceDescriptor):
         self.fqdn = fqdn
         self.endpoint_type = endpoint_type
 
+    @property
+    def res_key(self):
+        """Name of the Pacemaker resource managing the DNS entry
+
+        :returns: string
+        """
+        return 'res_{}_{}_hostname'.format(
+            self.service_name.replace('-', '_'),
+            self.endpoint_type)
+
     def configure_resource(self, crm, res_type='ocf:maas:dns'):
         """Configure new DNS resource in crm
 
@@ -682,9 +722,7 @@ class DNSEntry(ResourceDescriptor):
                                   agent to use for DNS HA
         :returns: None
         """
-        res_key = 'res_{}_{}_hostname'.format(
-            self.service_name.replace('-', '_'),
-            self.endpoint_type)
+        res_key = self.res_key
         res_params = ''
         if self.fqdn:
             res_params = '{} fqdn="{}"'.format(res_params, self.fqdn)
@@ -694,6 +732,8 @@ class DNSEntry(ResourceDescriptor):
 
 
 class SystemdService(ResourceDescriptor):
+    kind = 'systemd'
+
     def __init__(self, service_name, systemd_service_name, clone=True):
         """Class for managing systemd resource
 
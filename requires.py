@@ -11,8 +11,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import contextlib
+import functools
 import json
-import hashlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 import relations.hacluster.common
 from charms.reactive import hook
@@ -22,18 +29,60 @@ from charms.reactive.helpers import data_changed
 from charmhelpers.core import hookenv
 
 
+# Compact JSON encoding with sorted keys, bound once at import time
+# Matches the orjson encoding, which leaves non-ASCII text unescaped
+_json_dumps = functools.partial(
+    json.dumps, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+if orjson is not None:
+    _orjson_dumps = orjson.dumps
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS
+
+    def _dumps(value):
+        """Return the compact JSON encoding of value with its keys sorted.
+
+        :param value: JSON serialisable value
+        :returns: string - JSON encoding of value
+        """
+        return _orjson_dumps(value, option=_ORJSON_OPTIONS).decode('UTF-8')
+else:
+    _dumps = _json_dumps
+
+
+# String values the hacluster charm uses to report that it is clustered
+_TRUTHY = frozenset(['true', 'True', 'TRUE', 'yes', 'Yes', 'YES'])
+
+# Kinds of resource which are collected into a resource group
+GROUPED_KINDS = (
+    relations.hacluster.common.VirtualIP.kind,
+    relations.hacluster.common.DNSEntry.kind,
+)
+
+
 class HAClusterRequires(RelationBase):
     # The hacluster charm is a subordinate charm and really only works
     # for a single service to the HA Cluster relation, therefore set the
     # expected scope to be GLOBAL.
     scope = scopes.GLOBAL
 
+    def __init__(self, relation_name, conversations=None):
+        super(HAClusterRequires, self).__init__(relation_name, conversations)
+        self._crm_cache = None
+        self._crm_stored = False
+        self._group_members = None
+        self._pending_deletes = []
+        self._batch_depth = 0
+        self._resources_dirty = False
+        self._reset_remote_caches()
+
     @hook('{requires:hacluster}-relation-joined')
     def joined(self):
+        self._reset_remote_caches()
         self.set_state('{relation_name}.connected')
 
     @hook('{requires:hacluster}-relation-changed')
     def changed(self):
+        self._reset_remote_caches()
         if self.is_clustered():
             self.set_state('{relation_name}.available')
         else:
@@ -41,9 +90,42 @@ class HAClusterRequires(RelationBase):
 
     @hook('{requires:hacluster}-relation-{broken,departed}')
     def departed(self):
+        self._reset_remote_caches()
         self.remove_state('{relation_name}.available')
         self.remove_state('{relation_name}.connected')
 
+    def _reset_remote_caches(self):
+        """Discard remote relation data cached by a previous hook.
+
+        This is called on entry to each hook handler rather than through a
+        decorator, as charms.reactive identifies handlers by their code
+        object and a shared wrapper would merge them into one handler.
+        """
+        self._remote_cache = {}
+        self._unit_data_cache = {}
+        self._conversations_cache = None
+        self._related_units_cache = {}
+
+    def _cached_conversations(self):
+        """Return the conversations of this relation, cached per hook.
+
+        :returns: tuple - Conversation objects
+        """
+        if self._conversations_cache is None:
+            self._conversations_cache = tuple(self.conversations())
+        return self._conversations_cache
+
+    def _related_units(self, relation_id):
+        """Return the units related on relation_id, cached per hook.
+
+        :param relation_id: string - Relation id to list the units of
+        :returns: tuple - Names of the related units
+        """
+        if relation_id not in self._related_units_cache:
+            self._related_units_cache[relation_id] = tuple(
+                hookenv.related_units(relation_id))
+        return self._related_units_cache[relation_id]
+
     def is_clustered(self):
         """Has the hacluster charm set clustered?
 
@@ -53,18 +135,96 @@ class HAClusterRequires(RelationBase):
         :returns: boolean
         """
         clustered_values = self.get_remote_all('clustered')
-        if clustered_values:
-            # There is only ever one subordinate hacluster unit
-            clustered = clustered_values[0]
-            # Future versions of hacluster will return a bool
-            # Current versions return a string
-            if type(clustered) is bool:
-                return clustered
-            elif (clustered is not None and
-                    (clustered.lower() == 'true' or
-                     clustered.lower() == 'yes')):
-                return True
-        return False
+        if not clustered_values:
+            return False
+        # There is only ever one subordinate hacluster unit
+        clustered = clustered_values[0]
+        # Future versions of hacluster will return a bool
+        # Current versions return a string
+        if clustered is True:
+            return True
+        return isinstance(clustered, str) and clustered in _TRUTHY
+
+    def set_local(self, key=None, value=None, data=None, scope=None,
+                  **kwdata):
+        written = dict(data or {}, **kwdata)
+        if key is not None:
+            written[key] = value
+        if ('resources' in written and
+                written['resources'] is not self._crm_cache):
+            # Resources stored from elsewhere replace the batched view
+            self._crm_cache = None
+            self._group_members = None
+        super(HAClusterRequires, self).set_local(
+            key=key, value=value, data=data, scope=scope, **kwdata)
+
+    def _get_resources_crm(self):
+        """Return a CRM object for the locally stored resources.
+
+        Other instances of the relation may store resources between calls,
+        so the CRM is built from the stored resources on every call. Within
+        batch_resources it is built once and reused until the batch is
+        stored, and deletions queued by delete_resource are applied to it
+        before it is returned.
+
+        :returns: (CRM() instance, boolean) - Config object for Pacemaker
+                  resources, and whether any resources had been stored
+        """
+        if self._crm_cache is not None:
+            resources = self._crm_cache
+            stored = self._crm_stored
+        else:
+            resource_dict = self.get_local('resources')
+            stored = bool(resource_dict)
+            if resource_dict:
+                resources = relations.hacluster.common.CRM(**resource_dict)
+            else:
+                resources = relations.hacluster.common.CRM()
+            if self._batch_depth:
+                self._crm_cache = resources
+                self._crm_stored = stored
+        if self._pending_deletes:
+            for resource_name in self._pending_deletes:
+                resources.add_delete_resource(resource_name)
+            self._pending_deletes = []
+        # Changes made earlier in a batch count as stored resources
+        return resources, stored or self._resources_dirty
+
+    def _get_group_members(self, resources):
+        """Return the names of the grouped resources partitioned by kind.
+
+        The resources are partitioned in a single pass using the '_<kind>'
+        suffix their names end with, while the stored resources keep their
+        flat layout. Within batch_resources the partitions are kept and
+        updated as resources are added or deleted.
+
+        :param resources: CRM() instance - Resources to partition
+        :returns: dict - Sorted resource names keyed by kind
+        """
+        if self._group_members is not None:
+            return self._group_members
+        group_members = {kind: [] for kind in GROUPED_KINDS}
+        for res in sorted(resources['resources']):
+            kind = res.rpartition('_')[2]
+            if kind in group_members:
+                group_members[kind].append(res)
+        if self._batch_depth:
+            self._group_members = group_members
+        return group_members
+
+    def _add_group_member(self, resources, resource):
+        """Add a resource to the sorted group members of its kind.
+
+        :param resources: CRM() instance - Resources the resource was added to
+        :param resource: ResourceDescriptor - Resource to add
+        :returns: list - Sorted names of the group members
+        """
+        res_key = resource.res_key
+        members = self._get_group_members(resources)[resource.kind]
+        index = bisect.bisect_left(members, res_key)
+        if index == len(members) or members[index] != res_key:
+            members.insert(index, res_key)
+        return members
 
     def bind_on(self, iface=None, mcastport=None):
         relation_data = {}
@@ -74,8 +234,24 @@ class HAClusterRequires(RelationBase):
             relation_data['corosync_mcastport'] = mcastport
 
         if relation_data and data_changed('hacluster-bind_on', relation_data):
-            self.set_local(**relation_data)
-            self.set_remote(**relation_data)
+            self._send_remote(relation_data)
+
+    def _send_remote(self, relation_data):
+        """Store relation_data locally and send the changed items to the
+        remote units.
+
+        Items are compared with the values stored locally when they were
+        last sent, so values sent through another instance of the relation
+        are taken into account.
+
+        :param relation_data: dict - Relation data to be sent
+        :returns: None
+        """
+        delta = {k: v for k, v in relation_data.items()
+                 if self.get_local(k) != v}
+        if delta:
+            self.set_local(**delta)
+            self.set_remote(**delta)
 
     def manage_resources(self, crm):
         """
@@ -94,12 +270,11 @@ class HAClusterRequires(RelationBase):
         :returns: None
         """
         relation_data = {
-            'json_{}'.format(k): json.dumps(v, sort_keys=True)
+            'json_{}'.format(k): _dumps(v)
             for k, v in crm.items() if v
         }
         if data_changed('hacluster-manage_resources', relation_data):
-            self.set_local(**relation_data)
-            self.set_remote(**relation_data)
+            self._send_remote(relation_data)
 
     def bind_resources(self, iface=None, mcastport=None):
         """Inform the ha subordinate about each service it should manage. The
@@ -111,6 +286,7 @@ class HAClusterRequires(RelationBase):
         """
         if mcastport is None:
             mcastport = 4440
+        self._flush_resources()
         resources_dict = self.get_local('resources')
         self.bind_on(iface=iface, mcastport=mcastport)
         if resources_dict:
@@ -118,13 +294,84 @@ class HAClusterRequires(RelationBase):
             self.manage_resources(resources)
 
     def delete_resource(self, resource_name):
-        resource_dict = self.get_local('resources')
-        if resource_dict:
-            resources = relations.hacluster.common.CRM(**resource_dict)
+        if self._batch_depth:
+            # Within a batch the deletion is applied to the CRM when it is
+            # next needed, so deleting does not load the stored resources
+            self._pending_deletes.append(resource_name)
+            self._resources_dirty = True
+            if self._group_members is not None:
+                for members in self._group_members.values():
+                    if resource_name in members:
+                        members.remove(resource_name)
         else:
-            resources = relations.hacluster.common.CRM()
-        resources.add_delete_resource(resource_name)
-        self.set_local(resources=resources)
+            resources, _ = self._get_resources_crm()
+            resources.add_delete_resource(resource_name)
+            self.set_local(resources=resources)
+
+    def _add_resource(self, resource, group=None):
+        """Add a resource to the locally stored resources.
+
+        :param resource: ResourceDescriptor - Resource to add
+        :param group: string - Name of the group to add the resource to,
+                               together with the other resources of its kind
+        :returns: None
+        """
+        resources, stored = self._get_resources_crm()
+        resources.add(resource)
+        if group:
+            members = self._add_group_member(resources, resource)
+            # Resources are grouped once any resources have been stored,
+            # even if those have all been deleted since
+            if stored:
+                resources.group(group, *members)
+        self._store_resources(resources)
+
+    def _store_resources(self, resources):
+        """Store the resources, or defer storing them in a batch.
+
+        :param resources: CRM() instance - Resources to store
+        :returns: None
+        """
+        if self._batch_depth:
+            self._resources_dirty = True
+        else:
+            self.set_local(resources=resources)
+
+    def _flush_resources(self):
+        """Store resource changes deferred by batch_resources.
+
+        :returns: None
+        """
+        if self._resources_dirty:
+            resources, _ = self._get_resources_crm()
+            self._resources_dirty = False
+            self.set_local(resources=resources)
+
+    @contextlib.contextmanager
+    def batch_resources(self):
+        """Store the resource changes made in the context with one write.
+
+        By default every add_* and remove_* call writes the complete
+        resources to the local data. Within this context the changes are
+        stored once, when the outermost context exits, or earlier when
+        bind_resources is called:
+
+            with hacluster.batch_resources():
+                hacluster.add_vip('keystone', '10.0.0.10')
+                hacluster.add_init_service('keystone', 'haproxy')
+
+        Resources must not be changed through another instance of the
+        relation while the context is open.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._flush_resources()
+                self._crm_cache = None
+                self._group_members = None
 
     def add_vip(self, name, vip, iface=None, netmask=None):
         """Add a VirtualIP object for each user specified vip to self.resources
@@ -135,31 +382,13 @@ class HAClusterRequires(RelationBase):
         :param netmask: string - Netmask for vip
         :returns: None
         """
-        resource_dict = self.get_local('resources')
-        if resource_dict:
-            resources = relations.hacluster.common.CRM(**resource_dict)
-        else:
-            resources = relations.hacluster.common.CRM()
-        resources.add(
+        self._add_resource(
             relations.hacluster.common.VirtualIP(
                 name,
                 vip,
                 nic=iface,
-                cidr=netmask,))
-
-        # Vip Group
-        group = 'grp_{}_vips'.format(name)
-        vip_res_group_members = []
-        if resource_dict:
-            vip_resources = resource_dict.get('resources')
-            if vip_resources:
-                for vip_res in vip_resources:
-                    if 'vip' in vip_res:
-                        vip_res_group_members.append(vip_res)
-                resources.group(group,
-                                *sorted(vip_res_group_members))
-
-        self.set_local(resources=resources)
+                cidr=netmask,),
+            group='grp_{}_vips'.format(name))
 
     def remove_vip(self, name, vip, iface=None):
         """Remove a virtual IP
@@ -171,7 +400,7 @@ class HAClusterRequires(RelationBase):
         if iface:
             nic_name = iface
         else:
-            nic_name = hashlib.sha1(vip.encode('UTF-8')).hexdigest()[:7]
+            nic_name = relations.hacluster.common.vip_hash(vip)
         self.delete_resource('res_{}_{}_vip'.format(name, nic_name))
 
     def add_init_service(self, name, service, clone=True):
@@ -181,14 +410,8 @@ class HAClusterRequires(RelationBase):
         :param service: string - Name service uses in init system
         :returns: None
         """
-        resource_dict = self.get_local('resources')
-        if resource_dict:
-            resources = relations.hacluster.common.CRM(**resource_dict)
-        else:
-            resources = relations.hacluster.common.CRM()
-        resources.add(
+        self._add_resource(
             relations.hacluster.common.InitService(name, service, clone))
-        self.set_local(resources=resources)
 
     def remove_init_service(self, name, service):
         """Remove an init service
@@ -208,14 +431,8 @@ class HAClusterRequires(RelationBase):
         :param service: string - Name service uses in systemd
         :returns: None
         """
-        resource_dict = self.get_local('resources')
-        if resource_dict:
-            resources = relations.hacluster.common.CRM(**resource_dict)
-        else:
-            resources = relations.hacluster.common.CRM()
-        resources.add(
+        self._add_resource(
             relations.hacluster.common.SystemdService(name, service, clone))
-        self.set_local(resources=resources)
 
     def remove_systemd_service(self, name, service):
         """Remove a systemd service
@@ -237,27 +454,9 @@ class HAClusterRequires(RelationBase):
         :param endpoint_type: string - Public, private, internal etc
         :returns: None
         """
-        resource_dict = self.get_local('resources')
-        if resource_dict:
-            resources = relations.hacluster.common.CRM(**resource_dict)
-        else:
-            resources = relations.hacluster.common.CRM()
-        resources.add(
-            relations.hacluster.common.DNSEntry(name, ip, fqdn, endpoint_type))
-
-        # DNS Group
-        group = 'grp_{}_hostnames'.format(name)
-        dns_res_group_members = []
-        if resource_dict:
-            dns_resources = resource_dict.get('resources')
-            if dns_resources:
-                for dns_res in dns_resources:
-                    if 'hostname' in dns_res:
-                        dns_res_group_members.append(dns_res)
-                resources.group(group,
-                                *sorted(dns_res_group_members))
-
-        self.set_local(resources=resources)
+        self._add_resource(
+            relations.hacluster.common.DNSEntry(name, ip, fqdn, endpoint_type),
+            group='grp_{}_hostnames'.format(name))
 
     def remove_dnsha(self, name, endpoint_type):
         """Remove a DNS entry
@@ -267,19 +466,44 @@ class HAClusterRequires(RelationBase):
         :returns: None
         """
         res_key = 'res_{}_{}_hostname'.format(
-            self.service_name.replace('-', '_'),
-            self.endpoint_type)
+            name.replace('-', '_'),
+            endpoint_type)
         self.delete_resource(res_key)
 
+    def _get_unit_data(self, relation_id, unit):
+        """Return all relation data presented by a remote unit.
+
+        The data of each unit is fetched with a single relation-get and
+        cached for the lifetime of the hook invocation.
+
+        :param relation_id: string - Relation id the unit belongs to
+        :param unit: string - Name of the remote unit
+        :returns: dict - Relation data of the unit
+        """
+        cache_key = (relation_id, unit)
+        if cache_key not in self._unit_data_cache:
+            self._unit_data_cache[cache_key] = hookenv.relation_get(
+                unit=unit, rid=relation_id) or {}
+        return self._unit_data_cache[cache_key]
+
     def get_remote_all(self, key, default=None):
-        """Return a list of all values presented by remote units for key"""
+        """Return a list of all values presented by remote units for key
+
+        Duplicate values are dropped, keeping the order in which the remote
+        units presented them. Results are cached for the lifetime of the
+        hook invocation.
+        """
+        cache_key = (key, default)
+        if cache_key in self._remote_cache:
+            return self._remote_cache[cache_key]
         values = []
-        for conversation in self.conversations():
+        for conversation in self._cached_conversations():
             for relation_id in conversation.relation_ids:
-                for unit in hookenv.related_units(relation_id):
-                    value = hookenv.relation_get(key,
-                                                 unit,
-                                                 relation_id) or default
+                for unit in self._related_units(relation_id):
+                    unit_data = self._get_unit_data(relation_id, unit)
+                    value = unit_data.get(key) or default
                     if value:
                         values.append(value)
-        return list(set(values))
+        values = list(dict.fromkeys(values))
+        self._remote_cache[cache_key] = values
+        return values
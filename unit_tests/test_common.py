@@ -341,6 +341,7 @@ class TestHAClusterCommonVirtualIP(unittest.TestCase):
         self.assertEqual(vip_svc.vip, '10.110.1.1')
         self.assertIsNone(vip_svc.nic)
         self.assertIsNone(vip_svc.cidr)
+        self.assertEqual(vip_svc.kind, 'vip')
 
     def test_init_no_default(self):
         vip_svc = common.VirtualIP('apache', '10.110.1.1', 'eth1', '24')
@@ -375,6 +376,20 @@ class TestHAClusterCommonVirtualIP(unittest.TestCase):
              'meta migration-threshold="INFINITY" failure-timeout="5s"  '
              'op monitor timeout="20s" interval="10s" depth="0"'))
 
+    def test_res_key(self):
+        self.assertEqual(
+            common.VirtualIP('apache', '10.110.1.1', 'eth1').res_key,
+            'res_apache_eth1_vip')
+        self.assertEqual(
+            common.VirtualIP('apache', '10.110.1.1').res_key,
+            'res_apache_a7815c8_vip')
+        self.assertEqual(
+            common.VirtualIP('apache', 'fe80::1', 'eth1').res_key,
+            'res_apache_eth1_ipv6addr_vip')
+
+    def test_vip_hash(self):
+        self.assertEqual(common.vip_hash('10.110.1.1'), 'a7815c8')
+
 
 class TestHAClusterCommonDNSEntry(unittest.TestCase):
 
@@ -404,6 +419,14 @@ class TestHAClusterCommonDNSEntry(unittest.TestCase):
             crm['resource_params']['res_keystone_admin_hostname'],
             '  params  fqdn="keystone.admin" ip_address="10.110.1.1"')
 
+    def test_res_key(self):
+        dns_svc = common.DNSEntry(
+            'keystone-api',
+            '10.110.1.1',
+            'keystone.admin',
+            'admin')
+        self.assertEqual(dns_svc.res_key, 'res_keystone_api_admin_hostname')
+
 
 class TestHAClusterCommonSystemdService(unittest.TestCase):
 
@@ -11,6 +11,7 @@
 # limitations under the License.
 
 
+import copy
 import json
 from unittest import mock
 import unittest
@@ -101,9 +102,10 @@ class TestHAClusterRequires(unittest.TestCase):
         self._patches_start = None
 
     def _set_local(self, key=None, value=None, **kwdata):
+        # Store copies, as the unit data does not share objects with callers
         if key is not None:
-            self.reactive_db[key] = value
-        self.reactive_db.update(kwdata)
+            self.reactive_db[key] = copy.deepcopy(value)
+        self.reactive_db.update(copy.deepcopy(kwdata))
 
     def _get_db_res(self, key):
         return self.reactive_db['resources'][key]
@@ -119,6 +121,16 @@ class TestHAClusterRequires(unittest.TestCase):
         if preseed:
             self._set_local(resources=preseed)
 
+    def other_instance(self):
+        """Return another relation instance sharing the reactive db"""
+        other = requires.HAClusterRequires('some-relation', [])
+        for attr, side_effect in (('get_local', self._get_local),
+                                  ('set_local', self._set_local)):
+            _m = mock.patch.object(other, attr, side_effect=side_effect)
+            _m.start()
+            self.addCleanup(_m.stop)
+        return other
+
     def patch_kr(self, attr, return_value=None):
         mocked = mock.patch.object(self.cr, attr)
         self._patches[attr] = mocked
@@ -163,6 +175,9 @@ class TestHAClusterRequires(unittest.TestCase):
         self.get_remote_all.return_value = ['yes']
         self.assertTrue(self.cr.is_clustered())
 
+        self.get_remote_all.return_value = ['True']
+        self.assertTrue(self.cr.is_clustered())
+
         self.get_remote_all.return_value = None
         self.assertFalse(self.cr.is_clustered())
 
@@ -178,6 +193,8 @@ class TestHAClusterRequires(unittest.TestCase):
     def jsonify(self, options):
         json_encode_options = dict(
             sort_keys=True,
+            separators=(',', ':'),
+            ensure_ascii=False,
         )
         for k, v in options.items():
             if v:
@@ -203,6 +220,35 @@ class TestHAClusterRequires(unittest.TestCase):
         self.set_local.assert_called_once_with(**expected)
         self.set_remote.assert_called_once_with(**expected)
 
+    def test_manage_resources_from_several_instances(self):
+        res_a = common.CRM()
+        res_a.primitive('res_a', 'lsb:haproxy')
+        res_b = common.CRM()
+        res_b.primitive('res_b', 'lsb:haproxy')
+        self.data_changed.return_value = True
+        self.mock_reactive_db()
+        self.patch_kr('set_remote')
+        other = self.other_instance()
+        self.cr.manage_resources(res_a)
+        with mock.patch.object(other, 'set_remote'):
+            other.manage_resources(res_b)
+        # The resources sent through the other instance have to be replaced
+        self.set_remote.reset_mock()
+        self.cr.manage_resources(res_a)
+        self.assertEqual(self.data_changed.call_count, 3)
+        self.set_remote.assert_called_once_with(
+            json_resources='{"res_a":"lsb:haproxy"}')
+
+    def test__dumps(self):
+        value = {'b': ('res_b', 'res_a'), 'a': {'res': 'lsb:haproxy'}}
+        expected = '{"a":{"res":"lsb:haproxy"},"b":["res_b","res_a"]}'
+        self.assertEqual(requires._dumps(value), expected)
+        self.assertEqual(requires._json_dumps(value), expected)
+        value = {'res_café': 'params comment="Ünïcode"'}
+        expected = '{"res_café":"params comment=\\"Ünïcode\\""}'
+        self.assertEqual(requires._dumps(value), expected)
+        self.assertEqual(requires._json_dumps(value), expected)
+
     def test_manage_resources_no_change(self):
         res = common.CRM()
         res.primitive('res_neutron_haproxy', 'lsb:haproxy',
@@ -216,6 +262,39 @@ class TestHAClusterRequires(unittest.TestCase):
         self.assertFalse(self.set_local.called)
         self.assertFalse(self.set_remote.called)
 
+    def test_manage_resources_only_sends_changes(self):
+        res = common.CRM()
+        res.primitive('res_neutron_haproxy', 'lsb:haproxy')
+        self.data_changed.return_value = True
+        self.mock_reactive_db()
+        self.patch_kr('set_remote')
+        self.cr.manage_resources(res)
+        self.cr.manage_resources(res)
+        self.set_remote.assert_called_once_with(
+            json_resources='{"res_neutron_haproxy":"lsb:haproxy"}')
+        self.set_remote.reset_mock()
+        res.init_services('haproxy')
+        self.cr.manage_resources(res)
+        self.set_local.assert_called_with(
+            json_init_services='["haproxy"]')
+        self.set_remote.assert_called_once_with(
+            json_init_services='["haproxy"]')
+
+    def test_bind_on_from_several_instances(self):
+        self.data_changed.return_value = True
+        self.mock_reactive_db()
+        self.patch_kr('set_remote')
+        other = self.other_instance()
+        self.cr.bind_on(iface='eth0')
+        with mock.patch.object(other, 'set_remote') as other_set_remote:
+            other.bind_on(iface='eth1')
+        other_set_remote.assert_called_once_with(corosync_bindiface='eth1')
+        # The value sent through the other instance has to be replaced
+        self.cr.bind_on(iface='eth0')
+        self.assertEqual(self.set_remote.call_args_list, [
+            mock.call(corosync_bindiface='eth0'),
+            mock.call(corosync_bindiface='eth0')])
+
     def test_bind_resources(self):
         expected = {
             'colocations': {}, 'groups': {},
@@ -312,6 +391,27 @@ class TestHAClusterRequires(unittest.TestCase):
         self.assertFalse(
             'telnetd' in self._get_db_res('init_services'))
 
+    def test_delete_resource_deferred(self):
+        self.mock_reactive_db()
+        with self.cr.batch_resources():
+            self.cr.delete_resource('res_mysql_ens3_vip')
+            self.assertFalse(self.get_local.called)
+            self.assertFalse(self.set_local.called)
+        self.assertEqual(
+            self._get_local('resources')['delete_resources'],
+            ('res_mysql_ens3_vip',))
+
+    def test_delete_resource_from_another_instance(self):
+        self.mock_reactive_db()
+        other = self.other_instance()
+        self.cr.add_vip('mysql', '10.110.5.43')
+        other.delete_resource('res_mysql_4b8ce37_vip')
+        self.assertEqual(
+            self._get_local('resources')['delete_resources'],
+            ('res_mysql_4b8ce37_vip',))
+        self.assertIsNone(
+            self._get_db_res('resources').get('res_mysql_4b8ce37_vip'))
+
     def test_add_vip(self):
         expected = {
             'resources': {
@@ -386,6 +486,105 @@ class TestHAClusterRequires(unittest.TestCase):
         self.cr.add_vip('mysql', '10.120.5.43')
         self.set_local.assert_called_once_with(resources=expected)
 
+    def test_batch_builds_crm_once(self):
+        self.mock_reactive_db()
+        with self.cr.batch_resources():
+            self.cr.add_vip('mysql', '10.110.5.43')
+            self.cr.add_vip('mysql', '10.120.5.43')
+        self.get_local.assert_called_once_with('resources')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': ('res_mysql_1993276_vip '
+                                'res_mysql_4b8ce37_vip')})
+
+    def test_add_vip_after_delete(self):
+        self.mock_reactive_db()
+        self.cr.add_vip('mysql', '10.110.5.43')
+        self.cr.add_vip('mysql', '10.120.5.43')
+        self.cr.delete_resource('res_mysql_4b8ce37_vip')
+        self.cr.add_vip('mysql', '10.130.5.43')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': ('res_mysql_1993276_vip '
+                                'res_mysql_72ff38c_vip')})
+
+    def test_add_vip_after_remove(self):
+        self.mock_reactive_db()
+        self.cr.remove_vip('key-stone', '10.0.0.3')
+        self.cr.add_vip('mysql', '10.0.0.3', 'ens3')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': 'res_mysql_ens3_vip'})
+
+    def test_add_vip_after_remove_in_batch(self):
+        self.mock_reactive_db()
+        with self.cr.batch_resources():
+            self.cr.remove_vip('key-stone', '10.0.0.3')
+            self.cr.add_vip('mysql', '10.0.0.3', 'ens3')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': 'res_mysql_ens3_vip'})
+
+    def test_add_dnsha_after_remove(self):
+        self.mock_reactive_db()
+        self.cr.remove_dnsha('keystone', 'public')
+        self.cr.add_dnsha('keystone', '10.0.0.1', 'keystone.example.com',
+                          'public')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_keystone_hostnames': 'res_keystone_public_hostname'})
+
+    def test_add_vip_ignores_other_resources(self):
+        self.mock_reactive_db()
+        self.cr.add_init_service('mysql', 'vipd')
+        self.cr.add_vip('mysql', '10.110.5.43')
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': 'res_mysql_4b8ce37_vip'})
+
+    def test_add_resources_from_several_instances(self):
+        self.mock_reactive_db()
+        other = self.other_instance()
+        self.cr.add_vip('mysql', '10.110.5.43')
+        other.add_init_service('mysql', 'haproxy')
+        self.assertEqual(
+            sorted(self._get_db_res('resources')),
+            ['res_mysql_4b8ce37_vip', 'res_mysql_haproxy'])
+        # Changes made through the first instance keep the other's resources
+        self.cr.add_vip('mysql', '10.120.5.43')
+        self.assertEqual(
+            sorted(self._get_db_res('resources')),
+            ['res_mysql_1993276_vip', 'res_mysql_4b8ce37_vip',
+             'res_mysql_haproxy'])
+        self.assertEqual(
+            self._get_db_res('groups'),
+            {'grp_mysql_vips': ('res_mysql_1993276_vip '
+                                'res_mysql_4b8ce37_vip')})
+
+    def test_batch_resources(self):
+        self.mock_reactive_db()
+        with self.cr.batch_resources():
+            self.cr.add_vip('mysql', '10.110.5.43')
+            with self.cr.batch_resources():
+                self.cr.add_vip('mysql', '10.120.5.43')
+            self.assertFalse(self.set_local.called)
+        self.assertEqual(self.set_local.call_count, 1)
+        self.assertEqual(
+            sorted(self._get_db_res('resources')),
+            ['res_mysql_1993276_vip', 'res_mysql_4b8ce37_vip'])
+
+    def test_bind_resources_stores_batch(self):
+        self.mock_reactive_db()
+        self.patch_kr('bind_on')
+        self.patch_kr('manage_resources')
+        with self.cr.batch_resources():
+            self.cr.add_vip('mysql', '10.110.5.43')
+            self.cr.bind_resources()
+        self.set_local.assert_called_once_with(
+            resources=self._get_local('resources'))
+        self.manage_resources.assert_called_once_with(
+            self._get_local('resources'))
+
     def test_add_init_service(self):
         expected = {
             'resources': {
@@ -482,6 +681,12 @@ class TestHAClusterRequires(unittest.TestCase):
             'admin')
         self.set_local.assert_called_once_with(resources=expected)
 
+    def test_remove_dnsha(self):
+        self.patch_kr('delete_resource')
+        self.cr.remove_dnsha('keystone-api', 'public')
+        self.delete_resource.assert_called_once_with(
+            'res_keystone_api_public_hostname')
+
     @mock.patch.object(requires.hookenv, 'related_units')
     @mock.patch.object(requires.hookenv, 'relation_get')
     def test_get_remote_all(self, relation_get, related_units):
@@ -500,8 +705,8 @@ class TestHAClusterRequires(unittest.TestCase):
             'rid:3': {},
             'systemd_services': []}
 
-        def get_unit_data(key, unit, relation_id):
-            return unit_data[relation_id].get(unit, {}).get(key, {})
+        def get_unit_data(attribute=None, unit=None, rid=None):
+            return unit_data[rid].get(unit, {})
         conv1 = mock.MagicMock()
         conv1.relation_ids = ['rid:1', 'rid:2']
         conv2 = mock.MagicMock()
@@ -526,6 +731,26 @@ class TestHAClusterRequires(unittest.TestCase):
             self.cr.get_remote_all('key100', default='defaultvalue'),
             ['defaultvalue'])
 
+    @mock.patch.object(requires.hookenv, 'related_units')
+    @mock.patch.object(requires.hookenv, 'relation_get')
+    def test_get_remote_all_cached(self, relation_get, related_units):
+        conv = mock.MagicMock()
+        conv.relation_ids = ['rid:1']
+        self.patch_kr('conversations', [conv])
+        related_units.return_value = ['app1/0']
+        relation_get.return_value = {'key1': 'value1', 'key2': 'value2'}
+        self.assertEqual(self.cr.get_remote_all('key1'), ['value1'])
+        self.assertEqual(self.cr.get_remote_all('key1'), ['value1'])
+        self.assertEqual(self.cr.get_remote_all('key2'), ['value2'])
+        relation_get.assert_called_once_with(unit='app1/0', rid='rid:1')
+        related_units.assert_called_once_with('rid:1')
+        self.conversations.assert_called_once_with()
+        # A new hook invocation discards the cached values
+        self.patch_kr('remove_state')
+        self.cr.departed()
+        self.assertEqual(self.cr.get_remote_all('key1'), ['value1'])
+        self.assertEqual(relation_get.call_count, 2)
+
     def test_add_systemd_service(self):
         expected = {
             'resources': {